@@ -15,13 +15,12 @@
 #
 import json
 import logging
-from functools import reduce, partial
+from collections import Counter
+from functools import partial
 import networkx as nx
 import trio
 
 from api import settings
-from graphrag.general.community_reports_extractor import CommunityReportsExtractor
-from graphrag.entity_resolution import EntityResolution
 from graphrag.general.extractor import Extractor
 from graphrag.general.graph_extractor import DEFAULT_ENTITY_TYPES
 from graphrag.utils import graph_merge, set_entity, get_relation, set_relation, get_entity, get_graph, set_graph, \
@@ -58,29 +57,26 @@ class Dealer:
         self.callback = callback
 
     async def __call__(self):
-        docids = list(set([docid for docid, _ in self.chunks]))
+        docids = {docid for docid, _ in self.chunks}
         ents, rels = await self.ext(self.chunks, self.callback)
-        for en in ents:
-            self.graph.add_node(en["entity_name"], entity_type=en["entity_type"])#, description=en["description"])
-
-        for rel in rels:
-            self.graph.add_edge(
-                rel["src_id"],
-                rel["tgt_id"],
-                weight=rel["weight"],
-                #description=rel["description"]
-            )
+        self.graph.add_nodes_from(
+            (en["entity_name"], {"entity_type": en["entity_type"]}) for en in ents)#, "description": en["description"]
+        self.graph.add_edges_from(
+            (rel["src_id"], rel["tgt_id"], {"weight": rel["weight"]}) for rel in rels)#, "description": rel["description"]
 
         with RedisDistributedLock(self.kb_id, 60*60):
             old_graph, old_doc_ids = get_graph(self.tenant_id, self.kb_id)
-            if old_graph is not None:
+            if old_graph is not None and old_graph.number_of_nodes() > 0:
                 logging.info("Merge with an exiting graph...................")
-                self.graph = reduce(graph_merge, [old_graph, self.graph])
+                self.graph = graph_merge(old_graph, self.graph)
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                # get_node_attributes reads the internal node dict directly,
+                # so this never materializes (node, data) tuples per node.
+                logging.debug("Entity types: %s" % Counter(nx.get_node_attributes(self.graph, "entity_type").values()))
             update_nodes_pagerank_nhop_neighbour(self.tenant_id, self.kb_id, self.graph, 2)
             if old_doc_ids:
-                docids.extend(old_doc_ids)
-                docids = list(set(docids))
-            set_graph(self.tenant_id, self.kb_id, self.graph, docids)
+                docids |= set(old_doc_ids)
+            set_graph(self.tenant_id, self.kb_id, self.graph, list(docids))
 
 
 class WithResolution(Dealer):
@@ -107,6 +103,9 @@ class WithResolution(Dealer):
 
             if self.callback:
                 self.callback(msg="Fetch the existing graph.")
+            # Imported lazily: entity resolution drags in the whole LLM
+            # stack, which workers that never resolve shouldn't pay for.
+            from graphrag.entity_resolution import EntityResolution
             er = EntityResolution(self.llm_bdl,
                                   get_entity=partial(get_entity, self.tenant_id, self.kb_id),
                                   set_entity=partial(set_entity, self.tenant_id, self.kb_id, self.embed_bdl),
@@ -120,21 +119,25 @@ class WithResolution(Dealer):
             await trio.to_thread.run_sync(lambda: update_nodes_pagerank_nhop_neighbour(self.tenant_id, self.kb_id, self.graph, 2))
             await trio.to_thread.run_sync(lambda: set_graph(self.tenant_id, self.kb_id, self.graph, doc_ids))
 
-        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({
-            "knowledge_graph_kwd": "relation",
-            "kb_id": self.kb_id,
-            "from_entity_kwd": reso.removed_entities
-        }, search.index_name(self.tenant_id), self.kb_id))
-        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({
-            "knowledge_graph_kwd": "relation",
-            "kb_id": self.kb_id,
-            "to_entity_kwd": reso.removed_entities
-        }, search.index_name(self.tenant_id), self.kb_id))
-        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({
-            "knowledge_graph_kwd": "entity",
-            "kb_id": self.kb_id,
-            "entity_kwd": reso.removed_entities
-        }, search.index_name(self.tenant_id), self.kb_id))
+        # The three deletes are independent and network-bound, so issue
+        # them concurrently and wait for the slowest one.
+        async with trio.open_nursery() as nursery:
+            for condition in [{
+                "knowledge_graph_kwd": "relation",
+                "kb_id": self.kb_id,
+                "from_entity_kwd": reso.removed_entities
+            }, {
+                "knowledge_graph_kwd": "relation",
+                "kb_id": self.kb_id,
+                "to_entity_kwd": reso.removed_entities
+            }, {
+                "knowledge_graph_kwd": "entity",
+                "kb_id": self.kb_id,
+                "entity_kwd": reso.removed_entities
+            }]:
+                nursery.start_soon(trio.to_thread.run_sync,
+                                   partial(settings.docStoreConn.delete, condition,
+                                           search.index_name(self.tenant_id), self.kb_id))
 
 
 class WithCommunity(Dealer):
@@ -164,6 +167,9 @@ class WithCommunity(Dealer):
             if self.callback:
                 self.callback(msg="Fetch the existing graph.")
 
+            # Imported lazily: community detection pulls in graspologic
+            # and friends, a multi-second import on cold start.
+            from graphrag.general.community_reports_extractor import CommunityReportsExtractor
             cr = CommunityReportsExtractor(self.llm_bdl,
                                   get_entity=partial(get_entity, self.tenant_id, self.kb_id),
                                   set_entity=partial(set_entity, self.tenant_id, self.kb_id, self.embed_bdl),
@@ -182,16 +188,16 @@ class WithCommunity(Dealer):
             "kb_id": self.kb_id
         }, search.index_name(self.tenant_id), self.kb_id))
 
-        for stru, rep in zip(self.community_structure, self.community_reports):
+        chunks = []
+
+        async def tokenize_chunk(stru, rep):
             obj = {
                 "report": rep,
                 "evidences": "\n".join([f["explanation"] for f in stru["findings"]])
             }
             chunk = {
                 "docnm_kwd": stru["title"],
-                "title_tks": rag_tokenizer.tokenize(stru["title"]),
                 "content_with_weight": json.dumps(obj, ensure_ascii=False),
-                "content_ltks": rag_tokenizer.tokenize(obj["report"] +" "+ obj["evidences"]),
                 "knowledge_graph_kwd": "community_report",
                 "weight_flt": stru["weight"],
                 "entities_kwd": stru["entities"],
@@ -200,11 +206,26 @@ class WithCommunity(Dealer):
                 "source_id": doc_ids,
                 "available_int": 0
             }
-            chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
+
+            def tokenize():
+                chunk["title_tks"] = rag_tokenizer.tokenize(stru["title"])
+                chunk["content_ltks"] = rag_tokenizer.tokenize(obj["report"] +" "+ obj["evidences"])
+                chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
+            await trio.to_thread.run_sync(tokenize)
             #try:
             #    ebd, _ = self.embed_bdl.encode([", ".join(community["entities"])])
             #    chunk["q_%d_vec" % len(ebd[0])] = ebd[0]
             #except Exception as e:
             #    logging.exception(f"Fail to embed entity relation: {e}")
-            await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert([{"id": chunk_id(chunk), **chunk}], search.index_name(self.tenant_id)))
+            chunks.append({"id": chunk_id(chunk), **chunk})
+
+        # Tokenization is independent per community; run it on worker
+        # threads instead of serially on the event loop.
+        async with trio.open_nursery() as nursery:
+            for stru, rep in zip(self.community_structure, self.community_reports):
+                nursery.start_soon(tokenize_chunk, stru, rep)
+
+        if chunks:
+            # One bulk insert instead of a round-trip per community report.
+            await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks, search.index_name(self.tenant_id)))
 
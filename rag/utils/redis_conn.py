@@ -16,21 +16,58 @@
 
 import logging
 import json
+import random
 import time
 import uuid
 
+import threading
+from functools import wraps
+
+import ormsgpack
 import valkey as redis
 from rag import settings
 from rag.utils import singleton
 
 
+def _redis_retry(default=None, max_attempts=2):
+    """Centralize the try / log / reconnect boilerplate around RedisDB
+    methods. On failure the call is retried after a guarded reconnect;
+    `default` is returned when all attempts fail."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            for attempt in range(max_attempts):
+                if attempt:
+                    time.sleep(0.1 * (2 ** attempt))
+                    self._reconnect()
+                if not self.REDIS:
+                    continue
+                try:
+                    return func(self, *args, **kwargs)
+                except Exception as e:
+                    logging.warning("RedisDB.%s %s got exception: %s"
+                                    % (func.__name__, args[0] if args else "", e))
+            return default
+        return wrapper
+    return decorator
+
+
 class RedisMsg:
     def __init__(self, consumer, queue_name, group_name, msg_id, message):
         self.__consumer = consumer
         self.__queue_name = queue_name
         self.__group_name = group_name
         self.__msg_id = msg_id
-        self.__message = json.loads(message["message"])
+        # Stream fields arrive as bytes; json.loads accepts both.
+        fields = {k.decode("utf-8") if isinstance(k, bytes) else k: v
+                  for k, v in message.items()}
+        if "message" in fields:
+            # Wrapped form: the whole payload in a single JSON document.
+            # queue_product never emits a per-field entry containing a
+            # "message" field, so this is unambiguous.
+            self.__message = json.loads(fields["message"])
+        else:
+            self.__message = {k: json.loads(v) for k, v in fields.items()}
 
     def ack(self):
         try:
@@ -49,155 +86,142 @@ class RedisMsg:
 
 @singleton
 class RedisDB:
+    RECONNECT_MIN_INTERVAL = 1.0
+
     def __init__(self):
         self.REDIS = None
         self.config = settings.REDIS
+        self.__groups_created = set()
+        self.__reconnect_lock = threading.Lock()
+        self.__last_reconnect = 0.0
         self.__open__()
 
     def __open__(self):
         try:
-            self.REDIS = redis.StrictRedis(
+            # Replies stay as bytes so binary payloads (stream messages,
+            # msgpack objects) skip a forced UTF-8 decode; the few call
+            # sites that need strings decode explicitly.
+            pool = redis.ConnectionPool(
                 host=self.config["host"].split(":")[0],
                 port=int(self.config.get("host", ":6379").split(":")[1]),
                 db=int(self.config.get("db", 1)),
                 password=self.config.get("password"),
-                decode_responses=True,
+                max_connections=64,
+                decode_responses=False,
             )
+            self.REDIS = redis.StrictRedis(connection_pool=pool)
         except Exception:
             logging.warning("Redis can't be connected.")
         return self.REDIS
 
+    def _reconnect(self):
+        # Concurrent failures must not stampede reconnects: one attempt
+        # per interval, the rest keep the existing (possibly broken)
+        # client and fall through to their default return.
+        with self.__reconnect_lock:
+            if time.time() - self.__last_reconnect < self.RECONNECT_MIN_INTERVAL:
+                return
+            self.__last_reconnect = time.time()
+            self.__open__()
+
     def health(self):
         self.REDIS.ping()
         a, b = "xx", "yy"
         self.REDIS.set(a, b, 3)
 
-        if self.REDIS.get(a) == b:
+        if self.REDIS.get(a) == b.encode("utf-8"):
             return True
 
     def is_alive(self):
         return self.REDIS is not None
 
+    @_redis_retry()
     def exist(self, k):
-        if not self.REDIS:
-            return
-        try:
-            return self.REDIS.exists(k)
-        except Exception as e:
-            logging.warning("RedisDB.exist " + str(k) + " got exception: " + str(e))
-            self.__open__()
+        return self.REDIS.exists(k)
 
+    @_redis_retry()
     def get(self, k):
-        if not self.REDIS:
-            return
-        try:
-            return self.REDIS.get(k)
-        except Exception as e:
-            logging.warning("RedisDB.get " + str(k) + " got exception: " + str(e))
-            self.__open__()
+        v = self.REDIS.get(k)
+        if isinstance(v, bytes):
+            v = v.decode("utf-8")
+        return v
 
+    @_redis_retry(default=False)
     def set_obj(self, k, obj, exp=3600):
+        # ormsgpack serializes straight to bytes, skipping the
+        # intermediate unicode string json.dumps would allocate.
+        self.REDIS.set(k, ormsgpack.packb(obj), exp)
+        return True
+
+    @_redis_retry()
+    def get_obj(self, k):
+        v = self.REDIS.get(k)
+        if v is None:
+            return
+        if isinstance(v, str):
+            v = v.encode("utf-8")
         try:
-            self.REDIS.set(k, json.dumps(obj, ensure_ascii=False), exp)
-            return True
-        except Exception as e:
-            logging.warning("RedisDB.set_obj " + str(k) + " got exception: " + str(e))
-            self.__open__()
-        return False
+            return ormsgpack.unpackb(v)
+        except Exception:
+            # Entries written before the msgpack switch are JSON.
+            return json.loads(v)
 
+    @_redis_retry(default=False)
     def set(self, k, v, exp=3600):
-        try:
-            self.REDIS.set(k, v, exp)
-            return True
-        except Exception as e:
-            logging.warning("RedisDB.set " + str(k) + " got exception: " + str(e))
-            self.__open__()
-        return False
+        self.REDIS.set(k, v, exp)
+        return True
 
+    @_redis_retry(default=False)
     def sadd(self, key: str, member: str):
-        try:
-            self.REDIS.sadd(key, member)
-            return True
-        except Exception as e:
-            logging.warning("RedisDB.sadd " + str(key) + " got exception: " + str(e))
-            self.__open__()
-        return False
+        self.REDIS.sadd(key, member)
+        return True
 
+    @_redis_retry(default=False)
     def srem(self, key: str, member: str):
-        try:
-            self.REDIS.srem(key, member)
-            return True
-        except Exception as e:
-            logging.warning("RedisDB.srem " + str(key) + " got exception: " + str(e))
-            self.__open__()
-        return False
+        self.REDIS.srem(key, member)
+        return True
 
+    @_redis_retry()
     def smembers(self, key: str):
-        try:
-            res = self.REDIS.smembers(key)
-            return res
-        except Exception as e:
-            logging.warning(
-                "RedisDB.smembers " + str(key) + " got exception: " + str(e)
-            )
-            self.__open__()
-        return None
+        res = self.REDIS.smembers(key)
+        return {m.decode("utf-8") if isinstance(m, bytes) else m for m in res}
 
+    @_redis_retry(default=False)
     def zadd(self, key: str, member: str, score: float):
-        try:
-            self.REDIS.zadd(key, {member: score})
-            return True
-        except Exception as e:
-            logging.warning("RedisDB.zadd " + str(key) + " got exception: " + str(e))
-            self.__open__()
-        return False
+        self.REDIS.zadd(key, {member: score})
+        return True
 
+    @_redis_retry(default=0)
     def zcount(self, key: str, min: float, max: float):
-        try:
-            res = self.REDIS.zcount(key, min, max)
-            return res
-        except Exception as e:
-            logging.warning("RedisDB.zcount " + str(key) + " got exception: " + str(e))
-            self.__open__()
-        return 0
+        return self.REDIS.zcount(key, min, max)
 
+    @_redis_retry()
     def zpopmin(self, key: str, count: int):
-        try:
-            res = self.REDIS.zpopmin(key, count)
-            return res
-        except Exception as e:
-            logging.warning("RedisDB.zpopmin " + str(key) + " got exception: " + str(e))
-            self.__open__()
-        return None
+        return self.REDIS.zpopmin(key, count)
 
+    @_redis_retry()
     def zrangebyscore(self, key: str, min: float, max: float):
-        try:
-            res = self.REDIS.zrangebyscore(key, min, max)
-            return res
-        except Exception as e:
-            logging.warning(
-                "RedisDB.zrangebyscore " + str(key) + " got exception: " + str(e)
-            )
-            self.__open__()
-        return None
+        return self.REDIS.zrangebyscore(key, min, max)
 
+    @_redis_retry(default=False)
     def transaction(self, key, value, exp=3600):
-        try:
-            pipeline = self.REDIS.pipeline(transaction=True)
-            pipeline.set(key, value, exp, nx=True)
-            pipeline.execute()
-            return True
-        except Exception as e:
-            logging.warning(
-                "RedisDB.transaction " + str(key) + " got exception: " + str(e)
-            )
-            self.__open__()
-        return False
+        pipeline = self.REDIS.pipeline(transaction=True)
+        pipeline.set(key, value, exp, nx=True)
+        pipeline.execute()
+        return True
 
     def queue_product(self, queue, message, exp=settings.SVR_QUEUE_RETENTION) -> bool:
         for _ in range(3):
             try:
-                payload = {"message": json.dumps(message)}
+                if isinstance(message, dict) and message and "message" not in message:
+                    # Store the dict as stream fields directly, each value
+                    # JSON-encoded on its own, instead of re-wrapping the
+                    # already-serialized payload in another document. Dicts
+                    # carrying a "message" key take the wrapped form so the
+                    # consumer can tell the two formats apart by that field.
+                    payload = {k: json.dumps(v) for k, v in message.items()}
+                else:
+                    payload = {"message": json.dumps(message)}
                 pipeline = self.REDIS.pipeline()
                 pipeline.xadd(queue, payload)
                 # pipeline.expire(queue, exp)
@@ -209,12 +233,23 @@ class RedisDB:
                 )
         return False
 
+    def __ensure_group__(self, queue_name, group_name):
+        """Create the consumer group if needed, in one RTT instead of an
+        XINFO GROUPS pre-check. A local cache skips even that once the
+        group is known to exist."""
+        if (queue_name, group_name) in self.__groups_created:
+            return
+        try:
+            self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self.__groups_created.add((queue_name, group_name))
+
     def queue_consumer(self, queue_name, group_name, consumer_name, msg_id=b">") -> RedisMsg:
         """https://redis.io/docs/latest/commands/xreadgroup/"""
         try:
-            group_info = self.REDIS.xinfo_groups(queue_name)
-            if not any(e["name"] == group_name for e in group_info):
-                self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
+            self.__ensure_group__(queue_name, group_name)
             args = {
                 "groupname": group_name,
                 "consumername": consumer_name,
@@ -222,7 +257,17 @@ class RedisDB:
                 "block": 5,
                 "streams": {queue_name: msg_id},
             }
-            messages = self.REDIS.xreadgroup(**args)
+            try:
+                messages = self.REDIS.xreadgroup(**args)
+            except redis.exceptions.ResponseError as e:
+                if "NOGROUP" not in str(e):
+                    raise
+                # The stream and its group can be evicted under an
+                # allkeys-lru policy, so the created-groups cache can go
+                # stale; recreate the group and retry the read.
+                self.__groups_created.discard((queue_name, group_name))
+                self.__ensure_group__(queue_name, group_name)
+                messages = self.REDIS.xreadgroup(**args)
             if not messages:
                 return None
             stream, element_list = messages[0]
@@ -245,9 +290,7 @@ class RedisDB:
 
     def get_unacked_iterator(self, queue_name, group_name, consumer_name):
         try:
-            group_info = self.REDIS.xinfo_groups(queue_name)
-            if not any(e["name"] == group_name for e in group_info):
-                return
+            self.__ensure_group__(queue_name, group_name)
             current_min = 0
             while True:
                 payload = self.queue_consumer(queue_name, group_name, consumer_name, current_min)
@@ -262,13 +305,16 @@ class RedisDB:
             logging.exception(
                 "RedisDB.get_unacked_iterator " + consumer_name + " got exception: "
             )
-            self.__open__()
+            self._reconnect()
 
     def queue_info(self, queue, group_name) -> dict | None:
         try:
             groups = self.REDIS.xinfo_groups(queue)
             for group in groups:
-                if group["name"] == group_name:
+                name = group["name"]
+                if isinstance(name, bytes):
+                    name = name.decode("utf-8")
+                if name == group_name:
                     return group
         except Exception as e:
             logging.warning(
@@ -281,25 +327,98 @@ REDIS_CONN = RedisDB()
 
 
 class RedisDistributedLock:
-    def __init__(self, lock_key, timeout=10):
+    # One RTT per attempt: acquire with expiry, or report holder and TTL
+    # consistently in the same atomic call.
+    LUA_ACQUIRE = (
+        "local ok = redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) "
+        "if ok then return {1} end "
+        "return {0, redis.call('GET', KEYS[1]), redis.call('PTTL', KEYS[1])}"
+    )
+    ACQUIRE_SCRIPT = None
+    # None: not probed yet. True/False: whether keyspace notifications
+    # are available so waiters can sleep on pubsub instead of polling.
+    NOTIFICATIONS = None
+
+    def __init__(self, lock_key, timeout=10, hold_ttl=24 * 60 * 60):
         self.lock_key = lock_key
         self.lock_value = str(uuid.uuid4())
+        # timeout bounds how long acquire_lock waits; hold_ttl is how long
+        # the key lives once acquired. The default comfortably outlasts
+        # the longest locked sections (per-node doc-store updates on big
+        # graphs) while still reclaiming locks from crashed holders.
         self.timeout = timeout
+        self.hold_ttl = hold_ttl
+        if RedisDistributedLock.ACQUIRE_SCRIPT is None:
+            RedisDistributedLock.ACQUIRE_SCRIPT = REDIS_CONN.REDIS.register_script(self.LUA_ACQUIRE)
 
     @staticmethod
     def clean_lock(lock_key):
         REDIS_CONN.REDIS.delete(lock_key)
 
+    @classmethod
+    def __enable_notifications(cls):
+        if cls.NOTIFICATIONS is None:
+            try:
+                conf = REDIS_CONN.REDIS.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+                missing = [f for f in "Kgx" if f not in conf]
+                if missing:
+                    REDIS_CONN.REDIS.config_set("notify-keyspace-events", conf + "".join(missing))
+                cls.NOTIFICATIONS = True
+            except Exception as e:
+                logging.warning("RedisDistributedLock: can't enable keyspace notifications: " + str(e))
+                cls.NOTIFICATIONS = False
+        return cls.NOTIFICATIONS
+
+    def __wait_for_release(self, timeout):
+        """Sleep on the lock key's keyspace channel until it is deleted or
+        expires, instead of polling Redis. Returns as soon as an event
+        arrives or the timeout elapses."""
+        pubsub = REDIS_CONN.REDIS.pubsub()
+        try:
+            db = int(REDIS_CONN.config.get("db", 1))
+            pubsub.subscribe("__keyspace@%d__:%s" % (db, self.lock_key))
+            end_time = time.time() + timeout
+            while time.time() < end_time:
+                msg = pubsub.get_message(timeout=end_time - time.time())
+                if not msg:
+                    return
+                data = msg.get("data")
+                if isinstance(data, bytes):
+                    data = data.decode("utf-8", "ignore")
+                if msg.get("type") == "message" and data in ("del", "expired"):
+                    return
+        finally:
+            pubsub.close()
+
     def acquire_lock(self):
         end_time = time.time() + self.timeout
+        attempt = 0
         while time.time() < end_time:
-            if REDIS_CONN.REDIS.setnx(self.lock_key, self.lock_value):
+            res = RedisDistributedLock.ACQUIRE_SCRIPT(keys=[self.lock_key],
+                                                      args=[self.lock_value, max(1, int(self.hold_ttl))])
+            if res[0] == 1:
                 return True
-            time.sleep(1)
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("RedisDistributedLock: %s held by %s, pttl %s" % (self.lock_key, res[1], res[2]))
+            if self.__enable_notifications():
+                # Block on the keyspace channel until the holder releases.
+                # The wait is re-capped so a release that slips in between
+                # the failed SET and the subscribe can't strand us.
+                try:
+                    self.__wait_for_release(max(0, min(5.0, end_time - time.time())))
+                    attempt += 1
+                    continue
+                except Exception as e:
+                    logging.warning("RedisDistributedLock: pubsub wait on %s got exception: %s" % (self.lock_key, e))
+            # Exponential backoff with jitter so competing workers don't
+            # retry in lockstep, capped at the remaining acquire window.
+            delay = min(0.5, 0.01 * (2 ** attempt) * (0.5 + random.random()))
+            time.sleep(max(0, min(delay, end_time - time.time())))
+            attempt += 1
         return False
 
     def release_lock(self):
-        if REDIS_CONN.REDIS.get(self.lock_key) == self.lock_value:
+        if REDIS_CONN.REDIS.get(self.lock_key) == self.lock_value.encode("utf-8"):
             REDIS_CONN.REDIS.delete(self.lock_key)
 
     def __enter__(self):